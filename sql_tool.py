@@ -1,11 +1,29 @@
+import asyncio
+import atexit
+import base64
+import logging
+import logging.handlers
+import queue
+import re
 import sqlite3
-import json
 import os
+import pathlib
+import warnings
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from typing import List, Dict, Any, Optional
-from pydantic import BaseModel, Field
-from openai import OpenAI
+import aiosqlite
+import httpx
+import orjson
+import sqlglot
+from sqlglot import exp
+from sqlglot.tokens import TokenType
+from pydantic import BaseModel, ConfigDict, Field
+from openai import AsyncOpenAI
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.exceptions import FastAPIDeprecationWarning
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
@@ -15,11 +33,55 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize OpenAI Client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Debug output is only produced when LLM_SQL_DEBUG=1
+_DEBUG = os.getenv("LLM_SQL_DEBUG") == "1"
+
+# Log through a queue so request handlers never block on stdout/stderr
+log = logging.getLogger("llm_sql")
+if not log.handlers:
+    log.setLevel(logging.DEBUG if _DEBUG else logging.INFO)
+    log.propagate = False
+    _log_queue = queue.Queue(-1)
+    _log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+    log.addHandler(logging.handlers.QueueHandler(_log_queue))
+
+# Initialize OpenAI Client (one shared, pooled HTTP/2 connection pool)
+client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    ),
+)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Run the query batcher and own the shared clients for the app's lifetime."""
+    batcher.start()
+    yield
+    await batcher.stop()
+    await close_db()
+    await plan_cache.close()
+    await client.close()
+
+
+# ORJSONResponse is deprecated in the FastAPI release we run (0.143) but still
+# supported; keep it and don't emit the deprecation warning on every request
+warnings.filterwarnings(
+    "ignore",
+    message="ORJSONResponse is deprecated",
+    category=FastAPIDeprecationWarning,
+)
 
-# Initialize FastAPI app
-app = FastAPI(title="LLM SQL Query Tool")
+# Initialize FastAPI app (responses are encoded with orjson)
+app = FastAPI(
+    title="LLM SQL Query Tool",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
 
 # Add CORS middleware
 app.add_middleware(
@@ -30,12 +92,52 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Create templates and static directories if they don't exist
-os.makedirs("templates", exist_ok=True)
+# Create the static directory if it doesn't exist
 os.makedirs("static", exist_ok=True)
 
-# Create templates directory
-templates = Jinja2Templates(directory="templates")
+# Serve the HTML templates shipped next to this module
+templates = Jinja2Templates(
+    directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+)
+
+
+# --------------------------------------------------------------
+# JSON Helpers (orjson)
+# --------------------------------------------------------------
+def _dumps(obj, option=0):
+    """Serialize an object to a JSON string using orjson."""
+    return orjson.dumps(obj, option=option | orjson.OPT_NON_STR_KEYS).decode()
+
+
+_loads = orjson.loads
+
+
+class LRUCache:
+    """Size-bounded mapping that evicts the least recently used key."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+
+    def get(self, key):
+        """Return the value for a key, or None if it is not cached."""
+        if key not in self._items:
+            return None
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def put(self, key, value):
+        """Store a value, evicting the oldest entry when full."""
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+
+def preview(content, limit=100):
+    """Return at most ``limit`` characters of a value for debug logging."""
+    text = content if isinstance(content, str) else str(content)
+    return text[:limit] + ("..." if len(text) > limit else "")
 
 
 # --------------------------------------------------------------
@@ -56,16 +158,14 @@ class QueryResponse(BaseModel):
         description="The SQL query that was executed.", default=None
     )
 
-    class Config:
-        json_schema_extra = {"required": ["results", "response"]}
+    model_config = ConfigDict(json_schema_extra={"required": ["results", "response"]})
 
 
 # --------------------------------------------------------------
-# Function to Query SQLite Database
+# Locate the Database and Keep One Async Connection
 # --------------------------------------------------------------
-def query_perfbench_db(query):
-    """Executes a SQL query on the perfbench database and returns the results."""
-    # Try multiple paths to find the database
+def find_db_path():
+    """Return the first location of perfbench.db that exists, or None."""
     possible_paths = [
         os.path.join(
             os.path.dirname(os.path.abspath(__file__)), "data", "perfbench.db"
@@ -74,35 +174,230 @@ def query_perfbench_db(query):
         "/Users/nofilamer/LINUX-MACHINE/GITHUB/LLM-SQL/data/perfbench.db",  # Original path from the code
     ]
 
-    # Find the first path that exists
-    db_path = None
     for path in possible_paths:
         if os.path.exists(path):
-            db_path = path
-            break
+            return path
+    return None
+
 
-    if db_path is None:
-        raise FileNotFoundError("Could not find perfbench.db database file")
+# Resolve the database path once at startup and fail fast if it is missing
+_DB_PATH = find_db_path()
+if _DB_PATH is None:
+    raise FileNotFoundError("Could not find perfbench.db database file")
+
+# Read-only tuning applied to every connection
+_DB_PRAGMAS = """
+PRAGMA query_only = 1;
+PRAGMA mmap_size = 268435456;
+PRAGMA cache_size = -65536;
+PRAGMA temp_store = MEMORY;
+"""
+
+_db = None
+_db_lock = asyncio.Lock()
+
+
+async def get_db():
+    """Return the long-lived read-only aiosqlite connection, opening it once."""
+    global _db
+    async with _db_lock:
+        if _db is None:
+            db = await aiosqlite.connect(
+                pathlib.Path(_DB_PATH).as_uri() + "?mode=ro",
+                uri=True,
+                isolation_level=None,
+                cached_statements=SQL_PREPARE_CACHE_SIZE,
+            )
+            await db.executescript(_DB_PRAGMAS)
+            _db = db
+    return _db
 
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row  # Enable row factory for dict-like access
-    cursor = conn.cursor()
 
+async def close_db():
+    """Close the shared connection if it was opened."""
+    global _db
+    if _db is not None:
+        await _db.close()
+        _db = None
+
+
+# --------------------------------------------------------------
+# Validate and Parameterize LLM-Generated SQL
+# --------------------------------------------------------------
+# Number of parsed query shapes (and SQLite prepared statements) kept around
+SQL_PREPARE_CACHE_SIZE = 1024
+
+# Statements the read-only query tool must never run
+_FORBIDDEN_STATEMENTS = (exp.Insert, exp.Update, exp.Delete, exp.Drop, exp.Create)
+
+# Only literals in these clauses are bound as parameters, so projections
+# (and therefore result column names) are left as written
+_PARAMETER_CLAUSES = (exp.Where, exp.Having, exp.Join, exp.Limit, exp.Offset)
+
+
+def _is_parameter(literal):
+    """Whether a literal sits in a filter or limit of its own SELECT.
+
+    The nearest SELECT must be above the parameter clause, so the select list
+    of a subquery inside a WHERE or JOIN keeps its literals. For a JOIN only
+    the ON condition counts, not the joined table or subquery.
+    """
+    node = literal
+    while node.parent is not None:
+        parent = node.parent
+        if isinstance(parent, exp.Select):
+            return False
+        if isinstance(parent, exp.Join):
+            return node.arg_key == "on"
+        if isinstance(parent, _PARAMETER_CLAUSES):
+            return True
+        node = parent
+    return False
+
+
+@lru_cache(maxsize=SQL_PREPARE_CACHE_SIZE)
+def prepare_sql(query):
+    """Check that a query is a single read-only SELECT and bind its literals.
+
+    Returns (sql, params) where literal values in filters and limits are
+    replaced by named placeholders, so queries that differ only in their
+    constants share one SQLite prepared statement. sqlglot only validates
+    the query and locates the literals; the placeholders are spliced into
+    the original text, which is otherwise run exactly as written. Raises
+    ValueError for anything that is not a single SELECT.
+    """
     try:
-        cursor.execute(query)
-        columns = [description[0] for description in cursor.description]
+        statements = sqlglot.parse(query, read="sqlite")
+    except sqlglot.errors.SqlglotError as e:
+        raise ValueError(f"Could not parse SQL query: {e}") from e
 
-        raw_results = cursor.fetchall()
+    if len(statements) != 1 or statements[0] is None:
+        raise ValueError("Exactly one SQL statement must be given")
+    statement = statements[0]
+    if (
+        statement.find(exp.Select) is None
+        or statement.find(*_FORBIDDEN_STATEMENTS) is not None
+    ):
+        raise ValueError("Only read-only SELECT queries are allowed")
 
-        # Convert SQLite Row objects to dictionaries with column names
-        results = [dict(zip(columns, row)) for row in raw_results]
+    # Source spans of the literal tokens, to splice placeholders in at
+    literal_spans = {
+        (token.start, token.end)
+        for token in sqlglot.tokenize(query, read="sqlite")
+        if token.token_type in (TokenType.STRING, TokenType.NUMBER)
+    }
+
+    bindings = []
+    for literal in statement.find_all(exp.Literal):
+        # ORDER BY 1 / GROUP BY 1 are column positions, not values
+        if (
+            not _is_parameter(literal)
+            or literal.find_ancestor(exp.Order, exp.Group, exp.DataType) is not None
+        ):
+            continue
+
+        span = (literal.meta.get("start"), literal.meta.get("end"))
+        if span not in literal_spans:
+            continue
+
+        if literal.is_string:
+            value = literal.this
+        else:
+            try:
+                value = int(literal.this)
+            except ValueError:
+                try:
+                    value = float(literal.this)
+                except ValueError:
+                    continue
+
+        bindings.append((span, value))
+
+    # Number the placeholders in source order and splice them into the text
+    params = {}
+    pieces = []
+    position = 0
+    for (start, end), value in sorted(bindings):
+        name = f"p{len(params)}"
+        params[name] = value
+        pieces.append(query[position:start])
+        pieces.append(f":{name}")
+        position = end + 1
+    pieces.append(query[position:])
+    return "".join(pieces), params
+
+
+# --------------------------------------------------------------
+# Function to Query SQLite Database
+# --------------------------------------------------------------
+# Number of rows pulled from SQLite per fetchmany() call
+FETCH_BATCH_SIZE = 1024
+
+# Number of encoded query results kept in memory
+QUERY_CACHE_SIZE = 256
+
+# Encoded results keyed on (query, database mtime)
+_query_cache = LRUCache(QUERY_CACHE_SIZE)
 
-    except sqlite3.Error as e:
-        return {"error": str(e)}
-    finally:
-        conn.close()
 
-    return {"results": results}
+async def query_perfbench_db(query):
+    """Executes a SQL query on the perfbench database and returns the results.
+
+    The results are returned as JSON-encoded bytes of the form
+    {"columns": [...], "rows": [[...], ...]}, or {"error": "..."} on failure.
+    Results are cached until the database file changes; errors are not
+    cached, so a transient failure (e.g. a locked database) is retried.
+    """
+    key = (query, os.stat(_DB_PATH).st_mtime_ns)
+    result = _query_cache.get(key)
+    if result is None:
+        result = await _execute_query(query)
+        if not is_error_result(result):
+            _query_cache.put(key, result)
+    return result
+
+
+def _encode_value(value):
+    """orjson fallback for SQLite values it can't encode (BLOBs as base64)."""
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode()
+    raise TypeError
+
+
+async def _execute_query(query):
+    """Run a query on the shared connection and encode its results."""
+    try:
+        sql, params = prepare_sql(query)
+    except ValueError as e:
+        return orjson.dumps({"error": str(e)})
+
+    db = await get_db()
+
+    try:
+        async with db.execute(sql, params) as cursor:
+            columns = [description[0] for description in cursor.description]
+
+            # Encode rows in chunks so the full result set is never held twice
+            buf = bytearray(b'{"columns":')
+            buf += orjson.dumps(columns)
+            buf += b',"rows":['
+            first = True
+            while batch := await cursor.fetchmany(FETCH_BATCH_SIZE):
+                if not first:
+                    buf += b","
+                buf += orjson.dumps(batch, default=_encode_value)[1:-1]
+                first = False
+            buf += b"]}"
+
+    except (sqlite3.Error, orjson.JSONEncodeError) as e:
+        return orjson.dumps({"error": str(e)})
+
+    return bytes(buf)
+
+
+def is_error_result(result):
+    """Return True if encoded query results hold an error instead of rows."""
+    return result.startswith(b'{"error":')
 
 
 # --------------------------------------------------------------
@@ -130,7 +425,7 @@ tools = [
 # --------------------------------------------------------------
 # Define System Prompt with Database Schema
 # --------------------------------------------------------------
-system_prompt = (
+schema_prompt = (
     "You are a helpful assistant for querying benchmark results. "
     "If the question is not relevant to the benchmark results, respond with 'I don't know.' "
     "The database schema is as follows: "
@@ -145,113 +440,533 @@ system_prompt = (
     "benchmarks TEXT NOT NULL, "
     "benchmarkcontext TEXT, "
     "result TEXT);"
+)
+
+system_prompt = schema_prompt + (
     "Always respond in JSON format with the following structure exactly: "
     '{ "results": [...array of result objects...], "response": "natural language explanation" }'
+    " Return the results in JSON format."
 )
 
+# The system message never changes, so build it once; keeping it
+# byte-identical lets OpenAI serve it from the prompt cache
+_SYSTEM_MESSAGE = {"role": "system", "content": system_prompt}
+
+
+def log_prompt_usage(completion):
+    """Log how many prompt tokens OpenAI served from its prompt cache."""
+    if not log.isEnabledFor(logging.DEBUG) or completion.usage is None:
+        return
+    details = completion.usage.prompt_tokens_details
+    log.debug(
+        "Prompt tokens: %d (cached: %d)",
+        completion.usage.prompt_tokens,
+        (details.cached_tokens if details else None) or 0,
+    )
+
 
 # --------------------------------------------------------------
-# Define User Query Function
+# Cache SQL Plans for Repeated Questions
 # --------------------------------------------------------------
-def run_query(user_query):
-    """Run a natural language query against the database using LLM."""
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_query + " Return the results in JSON format."},
-    ]
+# Number of question -> SQL plans kept in memory
+PLAN_CACHE_SIZE = 1024
 
-    # Convert messages for JSON serialization
-    json_serializable_messages = [
-        msg.model_dump() if hasattr(msg, "model_dump") else msg for msg in messages
-    ]
+_PLAN_DB_PATH = os.getenv(
+    "LLM_SQL_PLAN_CACHE", os.path.join(os.path.dirname(_DB_PATH), "plan_cache.db")
+)
 
-    # Prepare JSON payload
-    json_payload = {
-        "model": "gpt-4o",
-        "messages": json_serializable_messages,
-        "response_format": {"type": "json_object"},
-        "tools": tools,
-    }
 
-    executed_sql_query = None
+def normalize_user_query(user_query):
+    """Collapse case and whitespace so equivalent questions share a plan."""
+    return re.sub(r"\s+", " ", user_query.strip().lower())
+
+
+class PlanCache:
+    """LRU of normalized question -> SQL, persisted in a SQLite table.
+
+    The table is read and written through its own aiosqlite connection,
+    so plan lookups never block the event loop.
+    """
+
+    def __init__(self, path, max_size=PLAN_CACHE_SIZE):
+        self.path = path
+        self._plans = LRUCache(max_size)
+        self._conn = None
+        self._lock = asyncio.Lock()
+
+    async def get(self, user_query):
+        """Return the cached SQL for a question, or None."""
+        key = normalize_user_query(user_query)
+        sql_query = self._plans.get(key)
+        if sql_query is not None:
+            return sql_query
+
+        try:
+            conn = await self._connect()
+            async with conn.execute(
+                "SELECT sql FROM plan_cache WHERE query = ?", (key,)
+            ) as cursor:
+                row = await cursor.fetchone()
+        except sqlite3.Error as e:
+            log.warning("Plan cache lookup failed: %s", e)
+            return None
+
+        if row is None:
+            return None
+        self._plans.put(key, row[0])
+        return row[0]
+
+    async def put(self, user_query, sql_query):
+        """Remember the SQL that answered a question."""
+        key = normalize_user_query(user_query)
+        self._plans.put(key, sql_query)
+        try:
+            conn = await self._connect()
+            async with conn.execute(
+                "INSERT OR REPLACE INTO plan_cache (query, sql) VALUES (?, ?)",
+                (key, sql_query),
+            ):
+                pass
+        except sqlite3.Error as e:
+            log.warning("Plan cache update failed: %s", e)
+
+    async def close(self):
+        """Close the plan cache connection if it was opened."""
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    async def _connect(self):
+        async with self._lock:
+            if self._conn is None:
+                conn = await aiosqlite.connect(self.path, isolation_level=None)
+                await conn.executescript("""
+                    PRAGMA journal_mode = WAL;
+                    PRAGMA synchronous = NORMAL;
+                    CREATE TABLE IF NOT EXISTS plan_cache (
+                        query TEXT PRIMARY KEY,
+                        sql TEXT NOT NULL
+                    );
+                    """)
+                self._conn = conn
+        return self._conn
+
+
+plan_cache = PlanCache(_PLAN_DB_PATH)
 
-    # Step 1: Call OpenAI Chat Completion API
-    completion = client.chat.completions.create(**json_payload)
 
-    # Append the original message to conversation history
-    messages.append(completion.choices[0].message)
+# --------------------------------------------------------------
+# Define User Query Function
+# --------------------------------------------------------------
+async def run_query(user_query):
+    """Run a natural language query against the database using LLM."""
+    messages = [
+        _SYSTEM_MESSAGE,
+        {"role": "user", "content": user_query},
+    ]
 
-    # Check if the model called any tools
-    if (
-        hasattr(completion.choices[0].message, "tool_calls")
-        and completion.choices[0].message.tool_calls
-    ):
-        for tool_call in completion.choices[0].message.tool_calls:
-            name = tool_call.function.name
-            args = json.loads(tool_call.function.arguments)
-
-            # Record the SQL query
-            if name == "query_perfbench_db" and "query" in args:
-                executed_sql_query = args["query"]
-
-            # Call function and get result
-            result = call_function(name, args)
-
-            # Append the tool response to conversation history
-            messages.append(
-                {
-                    "role": "tool",
-                    "tool_call_id": tool_call.id,
-                    "content": json.dumps(result),
-                }
-            )
+    executed_sql_query = await plan_cache.get(user_query)
+    tool_results = []
+
+    if executed_sql_query is not None:
+        # Replay the cached plan as if the model had just called the tool
+        log.debug("Using cached SQL plan: %s", executed_sql_query)
+        args = {"query": executed_sql_query}
+        result = await call_function("query_perfbench_db", args)
+        tool_results.append(result)
+
+        messages.append(
+            {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {
+                        "id": "call_cached_plan",
+                        "type": "function",
+                        "function": {
+                            "name": "query_perfbench_db",
+                            "arguments": _dumps(args),
+                        },
+                    }
+                ],
+            }
+        )
+        messages.append(tool_message("call_cached_plan", result))
+    else:
+        # Prepare JSON payload
+        json_payload = {
+            "model": "gpt-4o",
+            "messages": messages,
+            "response_format": {"type": "json_object"},
+            "tools": tools,
+        }
 
-    # Convert messages for JSON serialization again
-    json_serializable_messages = [
-        msg.model_dump() if hasattr(msg, "model_dump") else msg for msg in messages
-    ]
+        # Step 1: Call OpenAI Chat Completion API
+        completion = await client.chat.completions.create(**json_payload)
+        log_prompt_usage(completion)
+
+        # Append the original message to conversation history (the only
+        # non-dict message, so it is the only one that needs converting)
+        messages.append(completion.choices[0].message.model_dump())
+
+        # Check if the model called any tools
+        if (
+            hasattr(completion.choices[0].message, "tool_calls")
+            and completion.choices[0].message.tool_calls
+        ):
+            for tool_call in completion.choices[0].message.tool_calls:
+                name = tool_call.function.name
+                args = _loads(tool_call.function.arguments)
+
+                # Record the SQL query
+                if name == "query_perfbench_db" and "query" in args:
+                    executed_sql_query = args["query"]
+                    log.debug("Executing SQL: %s", executed_sql_query)
+
+                # Call function and get result
+                result = await call_function(name, args)
+                tool_results.append(result)
+
+                # Append the tool response to conversation history
+                messages.append(tool_message(tool_call.id, result))
+
+        # Only single-query plans that ran cleanly are worth replaying
+        if (
+            len(tool_results) == 1
+            and executed_sql_query is not None
+            and not is_error_result(tool_results[0])
+        ):
+            await plan_cache.put(user_query, executed_sql_query)
+
+    # Step 2: Report plain SELECT results without a second round-trip
+    if len(tool_results) == 1 and is_simple_select(executed_sql_query):
+        local_response = format_results_locally(tool_results[0], executed_sql_query)
+        if local_response is not None:
+            return local_response
 
     # Step 3: Send Final Response to OpenAI
-    completion_2 = client.chat.completions.create(
+    completion_2 = await client.chat.completions.create(
         model="gpt-4o",
-        messages=json_serializable_messages,
+        messages=messages,
         response_format={"type": "json_object"},
     )
+    log_prompt_usage(completion_2)
 
     # Parse the response
     try:
-        response_json = json.loads(completion_2.choices[0].message.content)
-
-        # Handle key naming differences (explanation → response)
-        if "explanation" in response_json and "response" not in response_json:
-            response_json["response"] = response_json.pop("explanation")
-
-        # Make sure the response field exists
-        if "response" not in response_json:
-            if "result" in response_json:
-                response_json["response"] = response_json.pop("result")
-            else:
-                response_json["response"] = "Query completed successfully."
-
-        # Make sure results field exists and is a list
-        if "results" not in response_json:
-            response_json["results"] = []
-
-        # Add the SQL query to the response
-        response_json["sql_query"] = executed_sql_query
-        return response_json
-    except json.JSONDecodeError:
+        response_json = _loads(completion_2.choices[0].message.content)
+    except orjson.JSONDecodeError:
         return {
             "results": [],
             "response": "Error processing results",
             "sql_query": executed_sql_query,
         }
+    return normalize_response(response_json, executed_sql_query)
+
+
+# --------------------------------------------------------------
+# Answer Simple Queries Locally
+# --------------------------------------------------------------
+# Aggregations need the LLM to explain them; anything else can be listed as-is
+_AGGREGATE_PATTERN = re.compile(
+    r"\b(GROUP\s+BY|AVG|SUM|COUNT|MIN|MAX|TOTAL|GROUP_CONCAT)\b", re.IGNORECASE
+)
+
+
+def is_simple_select(sql_query):
+    """Return True for a plain SELECT statement without aggregation."""
+    return (
+        bool(sql_query)
+        and sql_query.lstrip().upper().startswith("SELECT")
+        and not _AGGREGATE_PATTERN.search(sql_query)
+    )
+
+
+def format_results_locally(result, sql_query):
+    """Build the final answer from encoded query results, or None on error."""
+    if is_error_result(result):
+        return None
+
+    data = _loads(result)
+    # Materialize row dicts only here, for the web UI table
+    columns = data["columns"]
+    results = [dict(zip(columns, row)) for row in data["rows"]]
+    return {
+        "results": results,
+        "response": f"Returned {len(results)} "
+        f"{'row' if len(results) == 1 else 'rows'} from perf_data.",
+        "sql_query": sql_query,
+    }
+
+
+def normalize_response(response_json, executed_sql_query):
+    """Make sure an LLM JSON answer has the fields the web UI expects."""
+    # Handle key naming differences (explanation → response)
+    if "explanation" in response_json and "response" not in response_json:
+        response_json["response"] = response_json.pop("explanation")
+
+    # Make sure the response field exists
+    if "response" not in response_json:
+        if "result" in response_json:
+            response_json["response"] = response_json.pop("result")
+        else:
+            response_json["response"] = "Query completed successfully."
+
+    # Make sure results field exists and is a list
+    if "results" not in response_json:
+        response_json["results"] = []
+
+    # Add the SQL query to the response
+    response_json["sql_query"] = executed_sql_query
+    return response_json
 
 
 # Define function to call the appropriate function based on name
-def call_function(name, args):
+async def call_function(name, args):
     if name == "query_perfbench_db":
-        return query_perfbench_db(**args)
+        return await query_perfbench_db(**args)
+    return orjson.dumps({"error": f"Unknown function: {name}"})
+
+
+def tool_message(tool_call_id, result):
+    """Wrap encoded tool results as a tool message without re-encoding them."""
+    return {"role": "tool", "tool_call_id": tool_call_id, "content": result.decode()}
+
+
+# --------------------------------------------------------------
+# Batch Concurrent Queries into Shared LLM Calls
+# --------------------------------------------------------------
+# Batch size trades per-question cost against RPM headroom; 4-16 works well.
+BATCH_MAX_SIZE = int(os.getenv("LLM_SQL_BATCH_SIZE", "8"))
+BATCH_WINDOW_SECONDS = float(os.getenv("LLM_SQL_BATCH_WINDOW_MS", "20")) / 1000
+
+batch_plan_prompt = schema_prompt + (
+    "You will receive several numbered questions (Q1, Q2, ...). "
+    "For each question write one SQLite query that answers it, "
+    "or null if the question is not relevant to the benchmark results. "
+    "Always respond in JSON format with the following structure exactly: "
+    '{ "plans": [ { "index": 1, "sql": "SELECT ..." } ] }'
+)
+
+batch_answer_prompt = schema_prompt + (
+    "You will receive several numbered questions (Q1, Q2, ...), each with "
+    "the SQL query that was executed for it and the query results. "
+    "Answer every question using only its own results. "
+    "Always respond in JSON format with the following structure exactly: "
+    '{ "answers": [ { "index": 1, "results": [...array of result objects...], '
+    '"response": "natural language explanation" } ] }'
+)
+
+_BATCH_PLAN_MESSAGE = {"role": "system", "content": batch_plan_prompt}
+_BATCH_ANSWER_MESSAGE = {"role": "system", "content": batch_answer_prompt}
+
+
+def index_batch_items(content, key):
+    """Map the items of a batched JSON answer to their 1-based question index."""
+    try:
+        items = _loads(content).get(key, [])
+    except (orjson.JSONDecodeError, AttributeError):
+        return {}
+    return {
+        item["index"]: item
+        for item in items
+        if isinstance(item, dict) and isinstance(item.get("index"), int)
+    }
+
+
+async def execute_plan(sql_query):
+    """Run a planned SQL query, skipping empty plans."""
+    if not sql_query:
+        return None
+    return await call_function("query_perfbench_db", {"query": sql_query})
+
+
+async def run_query_batch(user_queries):
+    """Answer several natural language queries with at most two shared LLM calls."""
+    # Questions with a cached plan skip the planning call
+    sql_queries = list(
+        await asyncio.gather(
+            *(plan_cache.get(user_query) for user_query in user_queries)
+        )
+    )
+    unplanned = [
+        index for index, sql_query in enumerate(sql_queries, start=1) if not sql_query
+    ]
+
+    if unplanned:
+        questions = "\n".join(
+            f"Q{index}: {user_queries[index - 1]}" for index in unplanned
+        )
+
+        # Step 1: Ask for one SQL plan per remaining question
+        completion = await client.chat.completions.create(
+            model="gpt-4o",
+            messages=[
+                _BATCH_PLAN_MESSAGE,
+                {"role": "user", "content": questions},
+            ],
+            response_format={"type": "json_object"},
+        )
+        log_prompt_usage(completion)
+        plans = index_batch_items(completion.choices[0].message.content, "plans")
+        for index in unplanned:
+            sql_query = plans.get(index, {}).get("sql")
+            if isinstance(sql_query, str):
+                sql_queries[index - 1] = sql_query
+
+    # Step 2: Execute the planned SQL in parallel
+    results = list(
+        await asyncio.gather(
+            *(execute_plan(sql) for sql in sql_queries), return_exceptions=True
+        )
+    )
+
+    # A plan that raises only fails its own question
+    responses = [None] * len(user_queries)
+    for index, result in enumerate(results, start=1):
+        if isinstance(result, BaseException):
+            if not isinstance(result, Exception):
+                raise result
+            log.error("Batched query Q%d failed: %s", index, result)
+            results[index - 1] = None
+            responses[index - 1] = {
+                "results": [],
+                "response": "Error processing query",
+                "sql_query": sql_queries[index - 1],
+            }
+
+    # Remember the new plans that ran cleanly
+    await asyncio.gather(
+        *(
+            plan_cache.put(user_queries[index - 1], sql_queries[index - 1])
+            for index in unplanned
+            if results[index - 1] is not None
+            and not is_error_result(results[index - 1])
+        )
+    )
+
+    # Plain SELECT results are answered locally; the rest go back to the LLM
+    for index, (sql_query, result) in enumerate(zip(sql_queries, results)):
+        if (
+            responses[index] is None
+            and result is not None
+            and is_simple_select(sql_query)
+        ):
+            responses[index] = format_results_locally(result, sql_query)
+    pending = [
+        index for index, response in enumerate(responses, start=1) if not response
+    ]
+    if not pending:
+        return responses
+
+    sections = []
+    for index in pending:
+        sql_query, result = sql_queries[index - 1], results[index - 1]
+        sections.append(
+            f"Q{index}: {user_queries[index - 1]}\n"
+            f"SQL{index}: {sql_query or 'none'}\n"
+            f"R{index}: {result.decode() if result is not None else 'none'}"
+        )
+
+    # Step 3: Ask for all the remaining final answers at once
+    completion_2 = await client.chat.completions.create(
+        model="gpt-4o",
+        messages=[
+            _BATCH_ANSWER_MESSAGE,
+            {"role": "user", "content": "\n\n".join(sections)},
+        ],
+        response_format={"type": "json_object"},
+    )
+    log_prompt_usage(completion_2)
+    answers = index_batch_items(completion_2.choices[0].message.content, "answers")
+
+    for index in pending:
+        sql_query = sql_queries[index - 1]
+        if index in answers:
+            response_json = answers[index]
+            response_json.pop("index")
+            responses[index - 1] = normalize_response(response_json, sql_query)
+        else:
+            responses[index - 1] = {
+                "results": [],
+                "response": "Error processing results",
+                "sql_query": sql_query,
+            }
+    return responses
+
+
+class QueryBatcher:
+    """Coalesce queries arriving within a short window into one LLM batch."""
+
+    def __init__(self, max_size=BATCH_MAX_SIZE, window=BATCH_WINDOW_SECONDS):
+        self.max_size = max_size
+        self.window = window
+        self._queue = None
+        self._worker = None
+        self._batches = set()
+
+    def start(self):
+        """Start the collector task on the running event loop."""
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        """Cancel the collector task."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, user_query):
+        """Queue a query and wait for its response."""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((user_query, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Run the batch without blocking collection of the next one
+            task = asyncio.create_task(self._dispatch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _dispatch(self, batch):
+        user_queries = [user_query for user_query, _ in batch]
+        log.debug("Dispatching a batch of %d queries", len(user_queries))
+        try:
+            if len(user_queries) == 1:
+                responses = [await run_query(user_queries[0])]
+            else:
+                responses = await run_query_batch(user_queries)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), response in zip(batch, responses):
+            if not future.done():
+                future.set_result(response)
+
+
+batcher = QueryBatcher()
 
 
 # --------------------------------------------------------------
@@ -260,17 +975,26 @@ def call_function(name, args):
 @app.get("/")
 async def root(request: Request):
     """Serve the main HTML page"""
-    return templates.TemplateResponse("index.html", {"request": request})
+    return templates.TemplateResponse(request, "index.html")
 
 
-@app.post("/api/query", response_model=QueryResponse)
+# QueryResponse only documents the response; skipping response_model avoids
+# re-validating every result row before orjson encodes it
+@app.post("/api/query", responses={200: {"model": QueryResponse}})
 async def query(request: QueryRequest):
     """API endpoint to process natural language queries"""
     try:
-        result = run_query(request.query)
-
-        # Log the response for debugging
-        print(f"API Response: {json.dumps(result, indent=2)}")
+        result = await batcher.submit(request.query)
+
+        # Log a short summary of the response for debugging; the full
+        # result set can be large, so it is never stringified for the log
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(
+                "API Response: %d results, response=%s, sql_query=%s",
+                len(result.get("results") or []),
+                preview(result.get("response", "")),
+                result.get("sql_query"),
+            )
 
         # Make sure required fields exist before returning
         if "response" not in result:
@@ -278,256 +1002,19 @@ async def query(request: QueryRequest):
         if "results" not in result:
             result["results"] = []
 
-        return result
+        # Return only the documented fields, as response_model used to
+        return ORJSONResponse(
+            {
+                "results": result["results"],
+                "response": result["response"],
+                "sql_query": result.get("sql_query"),
+            }
+        )
     except Exception as e:
-        import traceback
-
-        print(f"Error processing query: {str(e)}")
-        print(traceback.format_exc())
+        log.exception("Error processing query: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# Create index.html template
-index_html = """<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>LLM SQL Query Tool</title>
-    <style>
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            line-height: 1.6;
-            color: #333;
-            max-width: 1200px;
-            margin: 0 auto;
-            padding: 20px;
-            background-color: #f9f9f9;
-        }
-        h1 {
-            color: #2c3e50;
-            text-align: center;
-            margin-bottom: 20px;
-        }
-        .container {
-            background-color: white;
-            padding: 25px;
-            border-radius: 8px;
-            box-shadow: 0 2px 10px rgba(0, 0, 0, 0.1);
-        }
-        .query-container {
-            margin-bottom: 20px;
-        }
-        #query {
-            width: 100%;
-            padding: 12px;
-            border: 1px solid #ddd;
-            border-radius: 4px;
-            font-size: 16px;
-            box-sizing: border-box;
-        }
-        #submit {
-            background-color: #3498db;
-            color: white;
-            border: none;
-            padding: 12px 24px;
-            border-radius: 4px;
-            cursor: pointer;
-            font-size: 16px;
-            transition: background-color 0.3s;
-            margin-top: 10px;
-        }
-        #submit:hover {
-            background-color: #2980b9;
-        }
-        .results {
-            margin-top: 30px;
-        }
-        .response-text {
-            background-color: #f8f9fa;
-            padding: 15px;
-            border-left: 4px solid #3498db;
-            margin-bottom: 20px;
-            border-radius: 4px;
-        }
-        table {
-            width: 100%;
-            border-collapse: collapse;
-            margin-bottom: 20px;
-        }
-        th, td {
-            padding: 12px 15px;
-            text-align: left;
-            border-bottom: 1px solid #ddd;
-        }
-        th {
-            background-color: #f2f2f2;
-            font-weight: bold;
-        }
-        tr:hover {
-            background-color: #f5f5f5;
-        }
-        .sql-query {
-            background-color: #f0f0f0;
-            padding: 15px;
-            border-radius: 4px;
-            font-family: monospace;
-            white-space: pre-wrap;
-            margin-bottom: 20px;
-            overflow-x: auto;
-        }
-        .loading {
-            text-align: center;
-            margin: 20px 0;
-            display: none;
-        }
-        .spinner {
-            border: 4px solid #f3f3f3;
-            border-top: 4px solid #3498db;
-            border-radius: 50%;
-            width: 30px;
-            height: 30px;
-            animation: spin 2s linear infinite;
-            margin: 0 auto;
-        }
-        @keyframes spin {
-            0% { transform: rotate(0deg); }
-            100% { transform: rotate(360deg); }
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>LLM SQL Query Tool</h1>
-        
-        <div class="query-container">
-            <p>Ask a question about the benchmark data:</p>
-            <textarea id="query" rows="4" placeholder="e.g., What are the top 5 jobs with the highest number of containers?"></textarea>
-            <button id="submit">Run Query</button>
-        </div>
-        
-        <div class="loading">
-            <div class="spinner"></div>
-            <p>Processing your query...</p>
-        </div>
-        
-        <div class="results" id="results" style="display: none;">
-            <h2>Results</h2>
-            
-            <h3>SQL Query</h3>
-            <div class="sql-query" id="sql-query"></div>
-            
-            <h3>Response</h3>
-            <div class="response-text" id="response-text"></div>
-            
-            <h3>Data</h3>
-            <div id="table-container"></div>
-        </div>
-    </div>
-
-    <script>
-        document.getElementById('submit').addEventListener('click', async () => {
-            const queryText = document.getElementById('query').value.trim();
-            
-            if (!queryText) {
-                alert('Please enter a query');
-                return;
-            }
-            
-            // Show loading indicator
-            document.querySelector('.loading').style.display = 'block';
-            document.getElementById('results').style.display = 'none';
-            
-            try {
-                const response = await fetch('/api/query', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({ query: queryText })
-                });
-                
-                if (!response.ok) {
-                    throw new Error('Network response was not ok');
-                }
-                
-                const data = await response.json();
-                
-                // Hide loading indicator
-                document.querySelector('.loading').style.display = 'none';
-                
-                // Show results section
-                document.getElementById('results').style.display = 'block';
-                
-                // Display SQL query
-                const sqlQueryElement = document.getElementById('sql-query');
-                sqlQueryElement.textContent = data.sql_query || 'No SQL query was executed';
-                
-                // Display natural language response
-                const responseTextElement = document.getElementById('response-text');
-                responseTextElement.textContent = data.response;
-                
-                // Create table for results
-                const tableContainer = document.getElementById('table-container');
-                tableContainer.innerHTML = '';
-                
-                if (data.results && data.results.length > 0) {
-                    const table = document.createElement('table');
-                    
-                    // Create table header
-                    const thead = document.createElement('thead');
-                    const headerRow = document.createElement('tr');
-                    
-                    Object.keys(data.results[0]).forEach(key => {
-                        const th = document.createElement('th');
-                        th.textContent = key;
-                        headerRow.appendChild(th);
-                    });
-                    
-                    thead.appendChild(headerRow);
-                    table.appendChild(thead);
-                    
-                    // Create table body
-                    const tbody = document.createElement('tbody');
-                    
-                    data.results.forEach(result => {
-                        const row = document.createElement('tr');
-                        
-                        Object.values(result).forEach(value => {
-                            const td = document.createElement('td');
-                            td.textContent = value;
-                            row.appendChild(td);
-                        });
-                        
-                        tbody.appendChild(row);
-                    });
-                    
-                    table.appendChild(tbody);
-                    tableContainer.appendChild(table);
-                } else {
-                    tableContainer.textContent = 'No results found';
-                }
-                
-            } catch (error) {
-                console.error('Error:', error);
-                document.querySelector('.loading').style.display = 'none';
-                alert('An error occurred while processing your query');
-            }
-        });
-    </script>
-</body>
-</html>
-"""
-
-
-# --------------------------------------------------------------
-# Create template files on startup
-# --------------------------------------------------------------
-def create_template_files():
-    with open("templates/index.html", "w") as f:
-        f.write(index_html)
-
-
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -535,50 +1022,35 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Main Execution
 # --------------------------------------------------------------
 if __name__ == "__main__":
-    # Create template files
-    create_template_files()
-
     # Check database connection
+    log.info("Found database at: %s", _DB_PATH)
     try:
-        # Try multiple paths to find the database
-        possible_paths = [
-            os.path.join(
-                os.path.dirname(os.path.abspath(__file__)), "data", "perfbench.db"
-            ),
-            os.path.join(os.getcwd(), "data", "perfbench.db"),
-            "/Users/nofilamer/LINUX-MACHINE/GITHUB/LLM-SQL/data/perfbench.db",  # Original path from the code
-        ]
-
-        # Find the first path that exists
-        db_path = None
-        for path in possible_paths:
-            if os.path.exists(path):
-                db_path = path
-                print(f"Found database at: {db_path}")
-                break
-
-        if db_path is None:
-            print("WARNING: Could not find perfbench.db database file")
-        else:
-            # Test the connection
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM perf_data")
-            count = cursor.fetchone()[0]
-            conn.close()
-            print(f"Successfully connected to database. Found {count} records.")
+        # Test the connection
+        conn = sqlite3.connect(_DB_PATH)
+        count = conn.execute("SELECT COUNT(*) FROM perf_data").fetchone()[0]
+        conn.close()
+        log.info("Successfully connected to database. Found %d records.", count)
     except Exception as e:
-        print(f"WARNING: Failed to connect to database: {str(e)}")
+        log.warning("Failed to connect to database: %s", e)
 
     # Check OpenAI API key
     if not os.getenv("OPENAI_API_KEY"):
-        print("WARNING: OPENAI_API_KEY environment variable is not set")
+        log.warning("OPENAI_API_KEY environment variable is not set")
     else:
-        print("OpenAI API key found in environment variables")
+        log.info("OpenAI API key found in environment variables")
 
     # Start the server
-    print("\n==================================================")
-    print("LLM SQL QUERY API RUNNING")
-    print("==================================================\n")
-    print("Access the web interface at: http://localhost:8000")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    log.info("==================================================")
+    log.info("LLM SQL QUERY API RUNNING")
+    log.info("==================================================")
+    log.info("Access the web interface at: http://localhost:8000")
+    # "auto" picks uvloop and httptools (from uvicorn[standard]) when installed
+    uvicorn.run(
+        "sql_tool:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",
+        http="auto",
+        workers=int(os.getenv("WEB_CONCURRENCY", "4")),
+        log_level="warning",
+    )
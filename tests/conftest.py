@@ -0,0 +1,60 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+
+# sql_tool builds its OpenAI client at import time
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import sql_tool  # noqa: E402
+from openai.types.chat import ChatCompletionMessage  # noqa: E402
+
+
+class FakeCompletions:
+    """Stands in for client.chat.completions, replying through a handler.
+
+    The handler gets the create() keyword arguments and returns the fields
+    of the assistant message, e.g. {"content": "..."} or {"tool_calls": [...]}.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.calls = []
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        message = ChatCompletionMessage(role="assistant", **self.handler(kwargs))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+@pytest.fixture
+def fake_llm(monkeypatch, tmp_path):
+    """Stub the OpenAI completions call and give each test its own plan cache."""
+    monkeypatch.setattr(
+        sql_tool, "plan_cache", sql_tool.PlanCache(str(tmp_path / "plan_cache.db"))
+    )
+
+    def install(handler):
+        fake = FakeCompletions(handler)
+        monkeypatch.setattr(sql_tool.client.chat.completions, "create", fake.create)
+        return fake
+
+    return install
+
+
+@pytest.fixture
+def run_async():
+    """Run a coroutine on a fresh loop, closing the SQLite connections after."""
+
+    def run(coro):
+        async def wrapper():
+            try:
+                return await coro
+            finally:
+                await sql_tool.close_db()
+                await sql_tool.plan_cache.close()
+
+        return asyncio.run(wrapper())
+
+    return run
@@ -0,0 +1,137 @@
+import asyncio
+import re
+
+import orjson
+
+import sql_tool
+
+PLANS = {
+    "list two jobs": "SELECT jobid FROM perf_data LIMIT 2",
+    "how many jobs are there": "SELECT COUNT(*) AS n FROM perf_data",
+    "how many jobs use 1 vcpu": "SELECT COUNT(*) AS n FROM perf_data WHERE vcpu = 1",
+    "list big jobs": "SELECT jobid, mem FROM perf_data WHERE mem > 50000 LIMIT 3",
+    "explode": "SELECT boom FROM perf_data",
+}
+
+
+def questions(kwargs):
+    """Map the Qn indices in a batched user message to their question text."""
+    content = kwargs["messages"][1]["content"]
+    return dict(re.findall(r"^Q(\d+): (.*)$", content, re.MULTILINE))
+
+
+def llm(answered=None):
+    """Plan from PLANS and answer every question, or only the given indices."""
+
+    def handler(kwargs):
+        asked = questions(kwargs)
+        if kwargs["messages"][0] is sql_tool._BATCH_PLAN_MESSAGE:
+            plans = [
+                {"index": int(index), "sql": PLANS[question]}
+                for index, question in asked.items()
+            ]
+            return {"content": orjson.dumps({"plans": plans}).decode()}
+
+        answers = [
+            {"index": int(index), "results": [], "response": f"answer {index}"}
+            for index in asked
+            if answered is None or int(index) in answered
+        ]
+        return {"content": orjson.dumps({"answers": answers}).decode()}
+
+    return handler
+
+
+def submit_all(user_queries):
+    """Submit queries concurrently through one batcher and collect responses."""
+
+    async def run():
+        batcher = sql_tool.QueryBatcher(max_size=8, window=0.05)
+        try:
+            return await asyncio.gather(
+                *(batcher.submit(user_query) for user_query in user_queries)
+            )
+        finally:
+            await batcher.stop()
+
+    return run()
+
+
+def test_batch_splits_answers_back_to_each_request(fake_llm, run_async):
+    fake = fake_llm(llm())
+    responses = run_async(
+        submit_all(["list two jobs", "how many jobs are there", "list big jobs"])
+    )
+
+    # One planning call; only the aggregate question needs an answering call
+    assert len(fake.calls) == 2
+    assert questions(fake.calls[1]) == {"2": "how many jobs are there"}
+
+    assert responses[0]["response"] == "Returned 2 rows from perf_data."
+    assert responses[0]["sql_query"] == PLANS["list two jobs"]
+    assert responses[1]["response"] == "answer 2"
+    assert responses[1]["sql_query"] == PLANS["how many jobs are there"]
+    assert responses[2]["sql_query"] == PLANS["list big jobs"]
+    assert all(row["mem"] > 50000 for row in responses[2]["results"])
+
+
+def test_missing_answer_only_fails_its_question(fake_llm, run_async):
+    fake_llm(llm(answered={1}))
+    responses = run_async(
+        sql_tool.run_query_batch(
+            ["how many jobs are there", "how many jobs use 1 vcpu"]
+        )
+    )
+
+    assert responses[0]["response"] == "answer 1"
+    assert responses[1] == {
+        "results": [],
+        "response": "Error processing results",
+        "sql_query": PLANS["how many jobs use 1 vcpu"],
+    }
+
+
+def test_failing_plan_only_fails_its_request(fake_llm, run_async, monkeypatch):
+    query_perfbench_db = sql_tool.query_perfbench_db
+
+    async def flaky_query(query):
+        if "boom" in query:
+            raise RuntimeError("boom")
+        return await query_perfbench_db(query)
+
+    monkeypatch.setattr(sql_tool, "query_perfbench_db", flaky_query)
+    fake = fake_llm(llm())
+    responses = run_async(submit_all(["explode", "list two jobs"]))
+
+    assert responses[0] == {
+        "results": [],
+        "response": "Error processing query",
+        "sql_query": PLANS["explode"],
+    }
+    assert responses[1]["response"] == "Returned 2 rows from perf_data."
+    # Nothing was left for the answering call
+    assert len(fake.calls) == 1
+
+
+def test_index_batch_items_skips_malformed_items():
+    content = orjson.dumps(
+        {"plans": [{"index": 1, "sql": "a"}, {"index": "2"}, "x", {"sql": "b"}]}
+    ).decode()
+    assert sql_tool.index_batch_items(content, "plans") == {1: {"index": 1, "sql": "a"}}
+    assert sql_tool.index_batch_items("not json", "plans") == {}
+    assert sql_tool.index_batch_items("[1, 2]", "plans") == {}
+
+
+def test_cached_plans_skip_the_planning_call(fake_llm, run_async):
+    fake = fake_llm(llm())
+
+    async def ask_twice():
+        await sql_tool.run_query_batch(["list two jobs", "list big jobs"])
+        return await sql_tool.run_query_batch(["List  TWO jobs", "LIST big jobs "])
+
+    responses = run_async(ask_twice())
+    assert len(fake.calls) == 1
+    assert [response["sql_query"] for response in responses] == [
+        PLANS["list two jobs"],
+        PLANS["list big jobs"],
+    ]
@@ -0,0 +1,86 @@
+import orjson
+
+import sql_tool
+
+COUNT_SQL = "SELECT COUNT(*) AS n FROM perf_data WHERE vcpu = 2"
+LIST_SQL = "SELECT jobid FROM perf_data WHERE vcpu = 2 LIMIT 3"
+
+
+def planner(sql_query):
+    """Call the query tool with sql_query, then answer from its result."""
+
+    def handler(kwargs):
+        if "tools" in kwargs:
+            call = {
+                "id": "call_1",
+                "type": "function",
+                "function": {
+                    "name": "query_perfbench_db",
+                    "arguments": orjson.dumps({"query": sql_query}).decode(),
+                },
+            }
+            return {"content": None, "tool_calls": [call]}
+        return {"content": '{"results": [], "response": "answered"}'}
+
+    return handler
+
+
+def test_rephrased_question_replays_the_cached_plan(fake_llm, run_async):
+    fake = fake_llm(planner(COUNT_SQL))
+
+    async def ask_twice():
+        first = await sql_tool.run_query("How many jobs use 2 vCPUs?")
+        second = await sql_tool.run_query("  how many JOBS   use 2 vcpus?")
+        return first, second
+
+    first, second = run_async(ask_twice())
+    assert first["sql_query"] == second["sql_query"] == COUNT_SQL
+
+    # Planning and answering for the first question, answering only for the second
+    assert ["tools" in call for call in fake.calls] == [True, False, False]
+    replayed = fake.calls[2]["messages"]
+    assert replayed[2]["tool_calls"][0]["id"] == "call_cached_plan"
+    assert replayed[3]["tool_call_id"] == "call_cached_plan"
+    assert "n" in orjson.loads(replayed[3]["content"])["columns"]
+
+
+def test_cached_simple_select_needs_no_completion(fake_llm, run_async):
+    fake = fake_llm(planner(LIST_SQL))
+
+    async def ask_twice():
+        await sql_tool.run_query("List three 2 vCPU jobs")
+        calls = len(fake.calls)
+        response = await sql_tool.run_query("list THREE 2 vcpu jobs")
+        return calls, response
+
+    calls, response = run_async(ask_twice())
+    assert calls == 1
+    assert len(fake.calls) == 1
+    assert response["response"] == "Returned 3 rows from perf_data."
+
+
+def test_failed_plans_are_not_cached(fake_llm, run_async):
+    fake_llm(planner("SELECT nope FROM perf_data"))
+    run_async(sql_tool.run_query("Show the nope column"))
+    assert run_async(sql_tool.plan_cache.get("show the nope column")) is None
+
+
+def test_plans_persist_across_instances(tmp_path, run_async):
+    path = str(tmp_path / "plans.db")
+
+    async def store():
+        cache = sql_tool.PlanCache(path)
+        try:
+            await cache.put("How many jobs?", COUNT_SQL)
+        finally:
+            await cache.close()
+
+    async def load():
+        cache = sql_tool.PlanCache(path)
+        try:
+            return await cache.get("how many   JOBS?")
+        finally:
+            await cache.close()
+
+    run_async(store())
+    assert run_async(load()) == COUNT_SQL
@@ -0,0 +1,65 @@
+import sqlite3
+
+import pytest
+
+import sql_tool
+
+# Typical LLM-generated queries; each must give the same columns and rows
+# whether it runs as written or through prepare_sql
+QUERIES = [
+    "SELECT count(*) FROM perf_data WHERE vcpu > 2",
+    "SELECT substr(jobid, 1, 8), ifnull(mem, 0) FROM perf_data WHERE mem > 8000",
+    "SELECT jobid, mem/1024, vcpu * 2 + 1 FROM perf_data WHERE containers >= 1 LIMIT 5",
+    "SELECT CAST(mem AS DECIMAL(10,2)) AS m FROM perf_data WHERE vcpu = 1 LIMIT 3",
+    "SELECT jobid, (SELECT max(mem) FROM perf_data WHERE vcpu > 4) AS top "
+    "FROM perf_data WHERE mem < 16000 LIMIT 3",
+    "SELECT benchmarks, COUNT(*) FROM perf_data GROUP BY 1 HAVING COUNT(*) > 3 "
+    "ORDER BY 2 DESC",
+    "SELECT jobid FROM perf_data WHERE benchmarks LIKE '%zip%' "
+    "AND useremail <> 'it''s' ORDER BY date DESC LIMIT 4 OFFSET 2",
+    "SELECT COUNT(*) FROM perf_data WHERE date >= date('2024-03-01', '-30 days') "
+    "AND vcpu IN (1, 2, -4)",
+    "SELECT p.jobid, q.n FROM perf_data p JOIN (SELECT vcpu, COUNT(*) AS n "
+    "FROM perf_data GROUP BY vcpu) q ON q.vcpu = p.vcpu AND q.n > 5 LIMIT 3",
+    "SELECT * FROM perf_data p JOIN (SELECT vcpu, 1 FROM perf_data) q "
+    "ON q.vcpu = p.vcpu LIMIT 1",
+    "SELECT jobid FROM perf_data WHERE vcpu IN (SELECT 2 FROM perf_data "
+    "WHERE mem > 8000) LIMIT 2",
+    "SELECT 'label' AS kind, round(avg(mem), 1) FROM perf_data WHERE mem > 1.5",
+]
+
+
+def fetch(sql, params=()):
+    conn = sqlite3.connect(sql_tool._DB_PATH)
+    try:
+        cursor = conn.execute(sql, params)
+        return [d[0] for d in cursor.description], cursor.fetchall()
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_prepared_query_matches_direct_execution(query):
+    sql, params = sql_tool.prepare_sql(query)
+    assert fetch(sql, params) == fetch(query)
+
+
+def test_literals_in_filters_are_bound():
+    sql, params = sql_tool.prepare_sql(
+        "SELECT jobid FROM perf_data WHERE mem > 8000 ORDER BY 1 LIMIT 5"
+    )
+    assert sql == "SELECT jobid FROM perf_data WHERE mem > :p0 ORDER BY 1 LIMIT :p1"
+    assert params == {"p0": 8000, "p1": 5}
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "DELETE FROM perf_data",
+        "SELECT 1; DROP TABLE perf_data",
+        "PRAGMA table_info(perf_data)",
+    ],
+)
+def test_non_select_statements_are_rejected(query):
+    with pytest.raises(ValueError):
+        sql_tool.prepare_sql(query)
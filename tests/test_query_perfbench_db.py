@@ -0,0 +1,46 @@
+import asyncio
+import base64
+import os
+
+import orjson
+
+import sql_tool
+
+
+def run_query(query):
+    async def run():
+        try:
+            return await sql_tool.query_perfbench_db(query)
+        finally:
+            await sql_tool.close_db()
+
+    return asyncio.run(run())
+
+
+def test_results_are_columns_and_rows():
+    data = orjson.loads(run_query("SELECT jobid, mem FROM perf_data LIMIT 3"))
+    assert data["columns"] == ["jobid", "mem"]
+    assert len(data["rows"]) == 3
+
+
+def test_blob_values_are_base64_encoded():
+    data = orjson.loads(
+        run_query("SELECT randomblob(4) AS b FROM perf_data WHERE vcpu = 2")
+    )
+    assert data["columns"] == ["b"]
+    assert data["rows"]
+    for (value,) in data["rows"]:
+        assert len(base64.b64decode(value)) == 4
+
+
+def test_sqlite_errors_are_returned_as_error_results():
+    result = run_query("SELECT nope FROM perf_data")
+    assert sql_tool.is_error_result(result)
+    assert "no such column" in orjson.loads(result)["error"]
+
+
+def test_error_results_are_not_cached():
+    query = "SELECT still_nope FROM perf_data"
+    assert sql_tool.is_error_result(run_query(query))
+    key = (query, os.stat(sql_tool._DB_PATH).st_mtime_ns)
+    assert sql_tool._query_cache.get(key) is None